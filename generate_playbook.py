@@ -1,49 +1,69 @@
 ﻿from __future__ import annotations
 
+import bisect
 import json
 import os
-from datetime import datetime, timedelta, timezone
-from zoneinfo import ZoneInfo
-
-import requests
-
-ET = ZoneInfo("America/New_York")
-
-def http_get_json(url: str, timeout: int = 25, params: dict | None = None):
-    r = requests.get(url, timeout=timeout, params=params, headers={"User-Agent": "btc-journal-bot/1.0"})
-    r.raise_for_status()
-    return r.json()
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+from journal_common import (
+    BAR_15M_MS,
+    BINANCE_KLINES_URL,
+    ET,
+    Klines,
+    env_flag,
+    epoch_ms,
+    http_get_json,
+    journal_json_bytes,
+    to_klines,
+    write_atomic,
+)
+
+COINBASE_SPOT_URL = "https://api.coinbase.com/v2/prices/BTC-USD/spot"
+OKX_FUNDING_URL = "https://www.okx.com/api/v5/public/funding-rate?instId=BTC-USDT-SWAP"
+
+# Static per-playbook risk rules; shared, never mutated.
+RISK_RULES = {
+    "max_risk_per_idea_R": 1.0,
+    "daily_stop_R": 2.0,
+    "funding_half_size_threshold": 0.0003,
+    "funding_no_trade_threshold": 0.0010,
+}
+
+# test_trade_id is "BTC-<YYYY-MM-DD>-0600-ET-TEST"
+TEST_TRADE_ID_PREFIX = "BTC-"
+TEST_TRADE_ID_SUFFIX = "-0600-ET-TEST"
+
+# Level geometry, in multiples of ATR14(15m): entries sit a quarter ATR beyond
+# the 24h range and 1R is 1.5 ATR.
+ENTRY_BUFFER_ATR = 0.25
+RISK_ATR = 1.5
+
+def resolve_now_et(date_et: str) -> datetime:
+    """06:00 ET on a YYYY-MM-DD date."""
+    try:
+        d = date.fromisoformat(date_et)
+    except ValueError:
+        raise SystemExit(f"DATE_ET must be YYYY-MM-DD, got {date_et!r}")
+    return datetime(d.year, d.month, d.day, 6, 0, tzinfo=ET)
 
 def in_run_window(now_et: datetime) -> bool:
     start = now_et.replace(hour=6, minute=0, second=0, microsecond=0)
     end = start + timedelta(minutes=10)
     return start <= now_et < end
 
-def _ms(dt: datetime) -> int:
-    return int(dt.timestamp() * 1000)
-
 def fetch_klines_vision(symbol: str, interval: str, start_et: datetime, end_et: datetime, limit: int = 1000):
-    url = "https://data-api.binance.vision/api/v3/klines"
     params = {
         "symbol": symbol,
         "interval": interval,
-        "startTime": _ms(start_et.astimezone(timezone.utc)),
-        "endTime": _ms(end_et.astimezone(timezone.utc)),
+        "startTime": epoch_ms(start_et),
+        "endTime": epoch_ms(end_et),
         "limit": limit,
     }
-    data = http_get_json(url, params=params)
+    data = http_get_json(BINANCE_KLINES_URL, params=params)
     if not isinstance(data, list) or not data:
         raise RuntimeError("Binance vision klines empty")
-    rows = []
-    for k in data:
-        rows.append({
-            "t_open_ms": int(k[0]),
-            "open": float(k[1]),
-            "high": float(k[2]),
-            "low": float(k[3]),
-            "close": float(k[4]),
-        })
-    return rows
+    return to_klines(data)
 
 def fetch_btc_price_at_0600_et(now_et: datetime) -> float:
     # use the 1m candle at/just before 06:00 ET
@@ -51,23 +71,26 @@ def fetch_btc_price_at_0600_et(now_et: datetime) -> float:
     end = now_et + timedelta(minutes=1)
     data = fetch_klines_vision("BTCUSDT", "1m", start, end, limit=20)
 
-    target_ms = _ms(now_et.astimezone(timezone.utc))
-    best = None
-    for c in data:
-        if c["t_open_ms"] <= target_ms:
-            best = c
-        else:
-            break
-    if best is None:
-        best = data[0]
-    return float(best["close"])
+    target_ms = epoch_ms(now_et)
+    # klines come back sorted by open time: binary-search the last open <= target
+    idx = max(0, bisect.bisect_right(data.t_open_ms, target_ms) - 1)
+    return float(data.close[idx])
+
+def close_at_from_15m(klines: Klines, now_et: datetime) -> float | None:
+    # Close of the last 15m bar that finished at/before now_et (the 05:45 bar for
+    # a 06:00 run); None when the lookback has no bar that recent.
+    target_ms = epoch_ms(now_et)
+    idx = bisect.bisect_right(klines.t_open_ms, target_ms - BAR_15M_MS) - 1
+    if idx < 0 or klines.t_open_ms[idx] < target_ms - 2 * BAR_15M_MS:
+        return None
+    return klines.close[idx]
 
 def fetch_btc_spot_usd_now() -> float:
-    data = http_get_json("https://api.coinbase.com/v2/prices/BTC-USD/spot")
+    data = http_get_json(COINBASE_SPOT_URL)
     return float(data["data"]["amount"])
 
 def fetch_okx_funding_snapshot_now() -> dict:
-    data = http_get_json("https://www.okx.com/api/v5/public/funding-rate?instId=BTC-USDT-SWAP")
+    data = http_get_json(OKX_FUNDING_URL)
     item = data["data"][0]
     return {
         "instId": item.get("instId"),
@@ -80,40 +103,56 @@ def fetch_okx_funding_snapshot_now() -> dict:
         "asof": "okx_current",
     }
 
-def atr14_15m(candles: list[dict]) -> float:
-    if len(candles) < 20:
+def atr14_15m(candles: Klines) -> float:
+    if len(candles.close) < 20:
         raise RuntimeError("Not enough candles for ATR")
-    trs = []
-    prev_close = candles[0]["close"]
-    for c in candles[1:]:
-        hi, lo, cl = c["high"], c["low"], c["close"]
-        tr = max(hi - lo, abs(hi - prev_close), abs(lo - prev_close))
-        trs.append(tr)
-        prev_close = cl
-    window = trs[-14:]
-    atr = sum(window) / max(1, len(window))
+    # Only the last 14 true ranges feed the average.
+    trs = [
+        max(hi - lo, abs(hi - prev_close), abs(lo - prev_close))
+        for hi, lo, prev_close in zip(candles.high[-14:], candles.low[-14:], candles.close[-15:-1])
+    ]
+    atr = sum(trs) / len(trs)
     return max(1.0, atr)
 
-def build_playbook(now_et: datetime, p: float, okx: dict, lookback_15m: list[dict], meta: dict) -> dict:
-    range_high = max(c["high"] for c in lookback_15m)
-    range_low = min(c["low"] for c in lookback_15m)
+def compute_levels(lookback_15m: Klines) -> tuple[float, float, float, tuple, tuple]:
+    """(range_high, range_low, atr, long_levels, short_levels); each side is
+    (entry, stop, tp1, tp2) rounded to cents."""
+    range_high = max(lookback_15m.high)
+    range_low = min(lookback_15m.low)
     atr = atr14_15m(lookback_15m)
 
-    buffer = 0.25 * atr
-    risk = 1.5 * atr
+    buffer = ENTRY_BUFFER_ATR * atr
+    risk = RISK_ATR * atr
+    risk2 = 2 * risk
 
     # Breakout style (may result in no-trigger days; that's GOOD signal)
     long_entry = round(range_high + buffer, 2)
-    long_stop = round(long_entry - risk, 2)
-    long_tp1 = round(long_entry + risk, 2)      # +1R
-    long_tp2 = round(long_entry + 2 * risk, 2)  # +2R
+    long_levels = (
+        long_entry,
+        round(long_entry - risk, 2),
+        round(long_entry + risk, 2),   # +1R
+        round(long_entry + risk2, 2),  # +2R
+    )
 
     short_entry = round(range_low - buffer, 2)
-    short_stop = round(short_entry + risk, 2)
-    short_tp1 = round(short_entry - risk, 2)      # +1R
-    short_tp2 = round(short_entry - 2 * risk, 2)  # +2R
+    short_levels = (
+        short_entry,
+        round(short_entry + risk, 2),
+        round(short_entry - risk, 2),   # +1R
+        round(short_entry - risk2, 2),  # +2R
+    )
+    return range_high, range_low, atr, long_levels, short_levels
+
+def time_ctx(now_et: datetime) -> dict[str, str]:
+    ymin = now_et.strftime("%Y-%m-%d %H:%M")
+    return {"ymin": ymin, "day": ymin[:10], "year": ymin[:4]}
+
+def build_playbook(ctx: dict[str, str], p: float, okx: dict, lookback_15m: Klines, meta: dict) -> dict:
+    range_high, range_low, atr, long_levels, short_levels = compute_levels(lookback_15m)
+    long_entry, long_stop, long_tp1, long_tp2 = long_levels
+    short_entry, short_stop, short_tp1, short_tp2 = short_levels
 
-    test_trade_id = f"BTC-{now_et:%Y-%m-%d}-0600-ET-TEST"
+    test_trade_id = TEST_TRADE_ID_PREFIX + ctx["day"] + TEST_TRADE_ID_SUFFIX
 
     return {
         "meta": {
@@ -122,17 +161,12 @@ def build_playbook(now_et: datetime, p: float, okx: dict, lookback_15m: list[dic
             "range_lookback_hours": 24,
             "atr14_15m": round(atr, 2),
         },
-        "run_timestamp_et": now_et.strftime("%Y-%m-%d %H:%M"),
-        "price_time_et": now_et.strftime("%Y-%m-%d %H:%M"),
+        "run_timestamp_et": ctx["ymin"],
+        "price_time_et": ctx["ymin"],
         "btc_spot_usd": round(p, 2),
         "derivatives_okx": okx,
         "levels": {"support": [round(range_low, 2)], "resistance": [round(range_high, 2)]},
-        "risk_rules": {
-            "max_risk_per_idea_R": 1.0,
-            "daily_stop_R": 2.0,
-            "funding_half_size_threshold": 0.0003,
-            "funding_no_trade_threshold": 0.0010,
-        },
+        "risk_rules": RISK_RULES,
         "paper_test_trade": {
             "test_trade_id": test_trade_id,
             "type": "OCO_conditional",
@@ -151,46 +185,61 @@ def build_playbook(now_et: datetime, p: float, okx: dict, lookback_15m: list[dic
         },
     }
 
-def out_path_for(now_et: datetime) -> str:
-    return os.path.join("journal", now_et.strftime("%Y"), f"{now_et:%Y-%m-%d}.json")
+def out_path_for(ctx: dict[str, str]) -> str:
+    return f"journal/{ctx['year']}/{ctx['day']}.json"
 
-def load_existing_updates(path: str) -> list[dict]:
+def existing_updates(raw: bytes) -> list[dict]:
+    """journal_updates carried over from the current file's bytes ([] if unreadable)."""
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            x = json.load(f)
+        x = json.loads(raw)
         if isinstance(x, dict) and isinstance(x.get("journal_updates"), list):
             return x["journal_updates"]
     except Exception:
         pass
     return []
 
-def write_daily_json(now_et: datetime, playbook: dict, overwrite: bool) -> tuple[str, bool]:
-    out_path = out_path_for(now_et)
+def write_daily_json(out_path: str, playbook: dict, overwrite: bool) -> tuple[str, bool]:
     os.makedirs(os.path.dirname(out_path), exist_ok=True)
 
-    if os.path.exists(out_path) and (not overwrite):
-        print(f"Already exists, skipping: {out_path}")
+    try:
+        with open(out_path, "rb") as f:
+            existing = f.read()
+    except FileNotFoundError:
+        existing = None
+
+    if existing is not None:
+        if not overwrite:
+            print(f"Already exists, skipping: {out_path}")
+            return out_path, False
+        playbook["journal_updates"] = existing_updates(existing)
+
+    data = journal_json_bytes(playbook)
+
+    # Identical bytes: leave the file (and its mtime) alone.
+    if existing == data:
+        print(f"Unchanged, skipping: {out_path}")
         return out_path, False
 
-    if os.path.exists(out_path):
-        playbook["journal_updates"] = load_existing_updates(out_path)
-
-    with open(out_path, "w", encoding="utf-8") as f:
-        json.dump(playbook, f, indent=2, sort_keys=True)
-        f.write("\n")
+    write_atomic(out_path, data)
 
     print(f"Wrote: {out_path}")
     return out_path, True
 
-def main() -> None:
-    date_et = (os.getenv("DATE_ET") or "").strip()
-    force = (os.getenv("FORCE_WRITE", "") or "").strip().lower() in {"1", "true", "yes", "y"}
-    overwrite = (os.getenv("FORCE_OVERWRITE", "") or "").strip().lower() in {"1", "true", "yes", "y"}
-    strict_hist = (os.getenv("STRICT_HISTORICAL", "") or "").strip().lower() in {"1", "true", "yes", "y"}
+def main(date_et: str | None = None, force: bool | None = None,
+         overwrite: bool | None = None, strict_hist: bool | None = None) -> None:
+    """Arguments left as None fall back to DATE_ET / FORCE_WRITE / FORCE_OVERWRITE /
+    STRICT_HISTORICAL, so the CLI and in-process callers (backfill) share one path."""
+    if date_et is None:
+        date_et = (os.getenv("DATE_ET") or "").strip()
+    if force is None:
+        force = env_flag("FORCE_WRITE")
+    if overwrite is None:
+        overwrite = env_flag("FORCE_OVERWRITE")
+    if strict_hist is None:
+        strict_hist = env_flag("STRICT_HISTORICAL")
 
     if date_et:
-        y, m, d = [int(x) for x in date_et.split("-")]
-        now_et = datetime(y, m, d, 6, 0, tzinfo=ET)
+        now_et = resolve_now_et(date_et)
         force = True
         strict_hist = True
         run_source = "backfill"
@@ -202,46 +251,58 @@ def main() -> None:
         print(f"Not in run window (ET): {now_et.isoformat()}")
         return
 
-    out_path = out_path_for(now_et)
+    ctx = time_ctx(now_et)
+    out_path = out_path_for(ctx)
+    # Nothing will be written: bail out before any network I/O.
     if os.path.exists(out_path) and (not overwrite):
         print(f"Today already exists, no overwrite: {out_path}")
         return
 
-    # Price at 06:00 ET
-    try:
-        btc = fetch_btc_price_at_0600_et(now_et)
-        price_source = "binance_vision_1m_close_at_0600_et"
-    except Exception as e:
-        if strict_hist:
-            raise
-        btc = fetch_btc_spot_usd_now()
-        price_source = f"coinbase_fallback_due_to:{type(e).__name__}"
-
-    # 24h lookback candles for range/ATR
+    # The lookback and funding requests are independent: run them concurrently.
     start = now_et - timedelta(hours=24)
     end = now_et
-    lookback_15m = fetch_klines_vision("BTCUSDT", "15m", start, end, limit=1000)
-
-    # Funding snapshot (current)
-    try:
-        okx = fetch_okx_funding_snapshot_now()
-        funding_source = "okx_current"
-    except Exception:
-        okx = {"asof": "missing"}
-        funding_source = "missing"
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        lookback_fut = pool.submit(fetch_klines_vision, "BTCUSDT", "15m", start, end, 1000)
+        funding_fut = pool.submit(fetch_okx_funding_snapshot_now)
+
+        # 24h lookback candles for range/ATR
+        lookback_15m = lookback_fut.result()
+
+        # Price at 06:00 ET from the lookback; the 1m endpoint only if it has no recent bar.
+        btc = close_at_from_15m(lookback_15m, now_et)
+        # v2: close of the 05:45-06:00 15m bar. Days before it recorded the close
+        # of the 06:00-06:01 1m bar (the 1m source below), a different price.
+        price_source = "binance_vision_15m_close_at_0600_et:v2"
+        if btc is None:
+            try:
+                btc = fetch_btc_price_at_0600_et(now_et)
+                price_source = "binance_vision_1m_close_at_0600_et"
+            except Exception as e:
+                if strict_hist:
+                    raise
+                btc = fetch_btc_spot_usd_now()
+                price_source = f"coinbase_fallback_due_to:{type(e).__name__}"
+
+        # Funding snapshot (current)
+        try:
+            okx = funding_fut.result()
+            funding_source = "okx_current"
+        except Exception:
+            okx = {"asof": "missing"}
+            funding_source = "missing"
 
     meta = {"source": run_source, "price_source": price_source, "funding_source": funding_source}
-    playbook = build_playbook(now_et, btc, okx, lookback_15m, meta)
+    playbook = build_playbook(ctx, btc, okx, lookback_15m, meta)
     # Ensure unscored days show as pending (avoids None in METRICS)
     playbook.setdefault("paper_test_trade_review", {
       "status": "pending",
-      "date_et": now_et.strftime("%Y-%m-%d"),
+      "date_et": ctx["day"],
       "triggered": "pending",
       "filled": False,
       "exit": "pending",
       "R": 0.0
     })
-    write_daily_json(now_et, playbook, overwrite=overwrite)
+    write_daily_json(out_path, playbook, overwrite=overwrite)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,158 @@
+﻿from __future__ import annotations
+
+import atexit
+import functools
+import hashlib
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from typing import NamedTuple
+from zoneinfo import ZoneInfo
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+ET = ZoneInfo("America/New_York")
+
+BAR_15M_MS = 15 * 60 * 1000
+
+BINANCE_KLINES_URL = "https://data-api.binance.vision/api/v3/klines"
+
+# Env-var booleans: 1/true/yes/y, case-insensitive.
+TRUTHY = frozenset({"1", "true", "yes", "y"})
+
+def env_flag(name: str, default: bool = False) -> bool:
+    # Unset or blank -> default; any other value is true only if it is in TRUTHY.
+    v = (os.getenv(name, "") or "").strip().lower()
+    return v in TRUTHY if v else default
+
+# Retry policy for every upstream session: transient 429/5xx get a short
+# backoff; urllib3 honours Retry-After.
+HTTP_RETRY = Retry(total=3, backoff_factor=0.2, status_forcelist=(429, 500, 502, 503, 504))
+
+# One pooled keep-alive session for every upstream call.
+_SESSION = requests.Session()
+_SESSION.headers.update({"User-Agent": "btc-journal-bot/1.0"})
+_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=16,
+    max_retries=HTTP_RETRY,
+))
+atexit.register(_SESSION.close)
+
+# Opt-in (HTTP_CACHE=1) on-disk response cache for repeated backfills.
+HTTP_CACHE_DIR = os.path.join(".cache", "http")
+HTTP_CACHE_TTL_S = 60.0
+
+# ~1000 klines is ~150 KB; fail fast on anything far beyond that.
+MAX_RESPONSE_BYTES = 2 * 1024 * 1024
+
+# Bar length per Binance interval unit ("1m", "15m", "1h", ...).
+_INTERVAL_UNIT_MS = {"m": 60_000, "h": 3_600_000, "d": 86_400_000}
+
+def write_atomic(path: str, data: bytes) -> None:
+    """Replace path via an fsynced sibling temp file, so readers never see a torn write."""
+    tmp = tempfile.NamedTemporaryFile("wb", dir=os.path.dirname(path) or ".", suffix=".tmp", delete=False)
+    try:
+        with tmp:
+            tmp.write(data)
+            tmp.flush()
+            os.fsync(tmp.fileno())
+        # NamedTemporaryFile is 0600; journal files and pages are plain 0644.
+        os.chmod(tmp.name, 0o644)
+        os.replace(tmp.name, path)
+    except BaseException:
+        try:
+            os.unlink(tmp.name)
+        except OSError:
+            pass
+        raise
+
+def journal_json_bytes(obj: dict) -> bytes:
+    """Serialized journal file: sorted keys, indent=2 (compact if JOURNAL_PRETTY=0), trailing newline."""
+    if env_flag("JOURNAL_PRETTY", default=True):
+        text = json.dumps(obj, indent=2, sort_keys=True)
+    else:
+        text = json.dumps(obj, separators=(",", ":"), sort_keys=True)
+    return (text + "\n").encode("utf-8")
+
+def _klines_final(params: dict | None, fetched_at: float) -> bool:
+    """True if a klines request was sent after the last bar it can return had closed."""
+    p = params or {}
+    end_ms = p.get("endTime")
+    interval = str(p.get("interval") or "")
+    try:
+        bar_ms = int(interval[:-1]) * _INTERVAL_UNIT_MS[interval[-1]]
+    except (ValueError, KeyError, IndexError):
+        return False
+    # The last bar opens at or before endTime and closes one bar later.
+    return end_ms is not None and fetched_at * 1000 >= int(end_ms) + bar_ms
+
+def _disk_cached(fn):
+    @functools.wraps(fn)
+    def wrapper(url: str, timeout: int = 25, params: dict | None = None):
+        if not env_flag("HTTP_CACHE"):
+            return fn(url, timeout=timeout, params=params)
+
+        key = hashlib.blake2b(json.dumps([url, params], sort_keys=True).encode("utf-8"), digest_size=16).hexdigest()
+        path = os.path.join(HTTP_CACHE_DIR, f"{key}.json")
+        try:
+            with open(path, "rb") as f:
+                entry = json.loads(f.read())
+            # Final klines never change; everything else gets the short TTL.
+            if entry.get("final") is True or time.time() - entry["ts"] < HTTP_CACHE_TTL_S:
+                return entry["body"]
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            pass
+
+        # Taken before the request: a bar that closes mid-request isn't counted as closed.
+        fetched_at = time.time()
+        body = fn(url, timeout=timeout, params=params)
+        entry = {"ts": fetched_at, "final": _klines_final(params, fetched_at), "body": body}
+        os.makedirs(HTTP_CACHE_DIR, exist_ok=True)
+        write_atomic(path, json.dumps(entry).encode("utf-8"))
+        return body
+    return wrapper
+
+@_disk_cached
+def http_get_json(url: str, timeout: int = 25, params: dict | None = None):
+    with _SESSION.get(url, timeout=timeout, params=params, stream=True) as r:
+        r.raise_for_status()
+        buf = bytearray()
+        for chunk in r.iter_content(64 * 1024):
+            buf += chunk
+            if len(buf) > MAX_RESPONSE_BYTES:
+                raise RuntimeError(f"Response too large (> {MAX_RESPONSE_BYTES} bytes): {url}")
+    return json.loads(buf)
+
+class Klines(NamedTuple):
+    """Candles stored column-wise: one index-aligned list per field."""
+    t_open_ms: list[int]
+    open: list[float]
+    high: list[float]
+    low: list[float]
+    close: list[float]
+
+def to_klines(rows: list) -> Klines:
+    """Raw Binance kline rows ([open_time, o, h, l, c, ...]) as Klines."""
+    if not rows:
+        return Klines([], [], [], [], [])
+    t, o, h, l, c = islice(zip(*rows), 5)
+    return Klines(
+        t_open_ms=list(map(int, t)),
+        open=list(map(float, o)),
+        high=list(map(float, h)),
+        low=list(map(float, l)),
+        close=list(map(float, c)),
+    )
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_ONE_MS = timedelta(milliseconds=1)
+
+def epoch_ms(dt: datetime) -> int:
+    # Exact integer ms for any aware datetime.
+    return (dt - _EPOCH) // _ONE_MS
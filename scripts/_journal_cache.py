@@ -0,0 +1,113 @@
+﻿from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sys
+from typing import Callable
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # repo root
+sys.path.insert(0, ROOT)
+
+from journal_common import write_atomic
+
+JOURNAL_DIR = os.path.join(ROOT, "journal")
+# Extracted rows per builder, keyed by day file (mtime_ns, size); git-ignored, safe to delete.
+CACHE_PATH = os.path.join(ROOT, ".cache", "journal_rows.json")
+
+def rel_path(path: str) -> str:
+    """Repo-relative, '/'-separated form of a path under ROOT."""
+    return path[len(ROOT) + 1:].replace(os.sep, "/")
+
+def read_json(path: str) -> dict | None:
+    try:
+        with open(path, "rb") as f:
+            x = json.loads(f.read())
+        return x if isinstance(x, dict) else None
+    except Exception:
+        return None
+
+def is_day_file_name(name: str) -> bool:
+    """YYYY-MM-DD.json"""
+    return len(name) == 15 and name[4] == "-" and name[7] == "-" and name.endswith(".json")
+
+def day_file_entries() -> list[os.DirEntry]:
+    """journal/<year>/YYYY-MM-DD.json as DirEntry objects, oldest first."""
+    out: list[os.DirEntry] = []
+    with os.scandir(JOURNAL_DIR) as years:
+        for y in sorted(years, key=lambda e: e.name):
+            if not (y.name.isdigit() and y.is_dir()):
+                continue
+            with os.scandir(y.path) as days:
+                out.extend(sorted((e for e in days if is_day_file_name(e.name)), key=lambda e: e.name))
+    return out
+
+def load_cache() -> dict:
+    try:
+        with open(CACHE_PATH, "rb") as f:
+            x = json.loads(f.read())
+        return x if isinstance(x, dict) else {}
+    except Exception:
+        return {}
+
+def write_if_changed(path: str, text: str | bytes) -> bool:
+    """write_atomic() the text (UTF-8 encoded if str) unless the file already holds it; True if written."""
+    data = text.encode("utf-8") if isinstance(text, str) else text
+    try:
+        with open(path, "rb") as f:
+            if f.read() == data:
+                return False
+    except FileNotFoundError:
+        pass
+    write_atomic(path, data)
+    return True
+
+def save_cache(cache: dict) -> None:
+    os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+    write_atomic(CACHE_PATH, json.dumps(cache).encode("utf-8"))
+
+def _extract_version(extract: Callable) -> str:
+    """Hash of the source file that defines extract: editing a builder drops its cached rows."""
+    with open(sys.modules[extract.__module__].__file__, "rb") as f:
+        return hashlib.blake2b(f.read(), digest_size=8).hexdigest()
+
+def cached_rows(
+    namespace: str,
+    extract: Callable[[str, dict], dict | None],
+    entries: list[os.DirEntry] | None = None,
+) -> list[dict]:
+    """extract(path, data) over day files (default: all), in file order.
+
+    Rows live under `namespace` in one cache file shared by the builders; only
+    files whose (mtime, size) changed since that builder last ran are parsed,
+    and a change to the builder's source (_extract_version) reparses them all.
+    Unreadable files and files extract() rejects (None) produce no row.
+    """
+    if entries is None:
+        entries = day_file_entries()
+    version = _extract_version(extract)
+    cache = load_cache()
+    ns = cache.get(namespace)
+    prev = ns["rows"] if isinstance(ns, dict) and ns.get("version") == version else {}
+    fresh: dict = {}
+    misses: list[str] = []
+    for entry in entries:
+        path = entry.path
+        st = entry.stat()
+        key = [st.st_mtime_ns, st.st_size]
+        hit = prev.get(path)
+        if hit and hit[0] == key:
+            fresh[path] = hit
+        else:
+            fresh[path] = [key, None]
+            misses.append(path)
+
+    for path in misses:
+        data = read_json(path)
+        fresh[path][1] = extract(path, data) if data is not None else None
+
+    # Entries for day files that no longer exist also count as a change.
+    if misses or len(fresh) != len(prev):
+        cache[namespace] = {"version": version, "rows": fresh}
+        save_cache(cache)
+    return [row for _, row in fresh.values() if row is not None]
@@ -1,16 +1,28 @@
 ﻿from __future__ import annotations
 
+import json
 import os
 import subprocess
 import sys
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
 from zoneinfo import ZoneInfo
 
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # repo root
+sys.path.insert(0, ROOT)
+
+import generate_playbook
+import score_day
+from journal_common import env_flag
+
 ET = ZoneInfo("America/New_York")
 
 def parse_date(s: str) -> datetime:
-    y, m, d = [int(x) for x in s.split("-")]
-    return datetime(y, m, d, tzinfo=ET)
+    try:
+        d = date.fromisoformat(s)
+    except ValueError:
+        raise SystemExit(f"Dates must be YYYY-MM-DD, got {s!r}")
+    return datetime(d.year, d.month, d.day, tzinfo=ET)
 
 def daterange(start: datetime, end: datetime):
     cur = start
@@ -18,47 +30,63 @@ def daterange(start: datetime, end: datetime):
         yield cur
         cur = cur + timedelta(days=1)
 
-def run_py(cmd: list[str], extra_env: dict[str, str] | None = None):
+def run_py(cmd: list[str], extra_env: dict[str, str] | None = None) -> int:
     env = os.environ.copy()
     if extra_env:
         env.update(extra_env)
-    r = subprocess.run([sys.executable] + cmd, env=env)
-    if r.returncode != 0:
-        raise SystemExit(r.returncode)
+    return subprocess.run([sys.executable] + cmd, env=env).returncode
+
+def check(rc: int) -> None:
+    if rc != 0:
+        raise SystemExit(rc)
+
+def run_per_date(label: str, fn, dates: list[str]) -> None:
+    # fn(date) in-process on a small thread pool; every date runs before failures are reported.
+    def run_one(d: str) -> BaseException | None:
+        try:
+            fn(d)
+        except (Exception, SystemExit) as e:
+            return e
+        return None
+
+    workers = max(1, int((os.getenv("BACKFILL_WORKERS") or "6").strip()))
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        errors = list(ex.map(run_one, dates))
+    failed = [(d, e) for d, e in zip(dates, errors) if e is not None]
+    for d, e in failed:
+        print(f"FAILED {label} for {d}: {e!r}")
+    if failed:
+        raise SystemExit(1)
 
 def main():
     start_s = (os.getenv("START_DATE_ET") or "").strip()
     end_s = (os.getenv("END_DATE_ET") or "").strip()
     mode = (os.getenv("MODE") or "generate_and_score").strip().lower()
-    overwrite = (os.getenv("FORCE_OVERWRITE") or "0").strip()
+    overwrite = env_flag("FORCE_OVERWRITE")
 
     if not start_s or not end_s:
         raise SystemExit("START_DATE_ET and END_DATE_ET required (YYYY-MM-DD).")
 
     start = parse_date(start_s)
     end = parse_date(end_s)
+    dates = [d.date().isoformat() for d in daterange(start, end)]
 
     # 1) generate (optional)
     if mode != "score_only":
-        for d in daterange(start, end):
-            date_et = d.strftime("%Y-%m-%d")
-            run_py(
-                ["generate_playbook.py"],
-                {
-                    "DATE_ET": date_et,
-                    "FORCE_WRITE": "1",
-                    "FORCE_OVERWRITE": overwrite,
-                    "STRICT_HISTORICAL": "1",
-                },
-            )
-
-    # 2) score each day
-    for d in daterange(start, end):
-        date_et = d.strftime("%Y-%m-%d")
-        run_py(["scripts/score_day.py"], {"DATE_ET": date_et})
+        run_per_date(
+            "generate_playbook",
+            lambda d: generate_playbook.main(date_et=d, force=True, overwrite=overwrite, strict_hist=True),
+            dates,
+        )
+
+    # 2) score every day: one paged candle fetch for the days not yet scored
+    print(json.dumps(score_day.score_many(dates), indent=2))
 
     # 3) rebuild markdown views
-    run_py(["scripts/build_dashboard.py"])
-    run_py(["scripts/build_index.py"])\n    run_py(["scripts/build_metrics.py"])\nif __name__ == "__main__":
+    check(run_py(["scripts/build_dashboard.py"]))
+    check(run_py(["scripts/build_index.py"]))
+    check(run_py(["scripts/build_metrics.py"]))
+
+if __name__ == "__main__":
     main()
 
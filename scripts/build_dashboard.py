@@ -1,25 +1,16 @@
 ﻿from __future__ import annotations
 
-import json
 import os
-from glob import glob
+import re
 from collections import Counter
 from typing import Any
 
-ROOT = os.path.dirname(os.path.abspath(os.path.join(__file__, "..", "..")))
-JOURNAL_DIR = os.path.join(ROOT, "journal")
+from _journal_cache import JOURNAL_DIR, ROOT, cached_rows, rel_path, write_if_changed
+
 OUT_MD = os.path.join(JOURNAL_DIR, "DASHBOARD.md")
 
 BLOCKS = "▁▂▃▄▅▆▇█"
 
-def read_json(path: str) -> dict | None:
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            x = json.load(f)
-        return x if isinstance(x, dict) else None
-    except Exception:
-        return None
-
 def get_path(d: dict, path: str, default=None):
     cur: Any = d
     for k in path.split("."):
@@ -28,16 +19,27 @@ def get_path(d: dict, path: str, default=None):
         cur = cur[k]
     return cur
 
-def pick_str(d: dict, keys: list[str]) -> str:
+# Where results and R live, by scorer version (first non-empty key wins).
+RESULT_KEYS = ("daily_result", "result", "outcome", "paper_test_trade_result", "status")
+REVIEW_RESULT_KEYS = ("result", "outcome", "status")
+R_KEYS = ("daily_R", "R", "paper_test_trade_R", "realized_R")
+REVIEW_R_KEYS = ("R", "realized_R", "score_R")
+SPOT_KEYS = ("btc_spot_usd",)
+
+def pick_str(d: dict, keys: tuple[str, ...]) -> str:
+    get = d.get
     for k in keys:
-        v = d.get(k)
-        if isinstance(v, str) and v.strip():
-            return v.strip()
+        v = get(k)
+        if type(v) is str:
+            v = v.strip()
+            if v:
+                return v
     return ""
 
-def pick_num(d: dict, keys: list[str]):
+def pick_num(d: dict, keys: tuple[str, ...]):
+    get = d.get
     for k in keys:
-        v = d.get(k)
+        v = get(k)
         if isinstance(v, (int, float)):
             return float(v)
         if isinstance(v, str):
@@ -47,20 +49,25 @@ def pick_num(d: dict, keys: list[str]):
                 pass
     return None
 
+# Substring markers per bucket, checked in this order (first match wins).
+SKIP_RE = re.compile(r"skip|no trade")
+LOSS_RE = re.compile(r"stop|loss|-1r|-0\.")
+WIN_RE = re.compile(r"tp|hit|win|\+|profit")
+
 def classify_result(result: str) -> str:
     r = (result or "").lower()
-    if any(x in r for x in ["skip", "skipped", "no trade"]):
+    if SKIP_RE.search(r):
         return "skipped"
-    if any(x in r for x in ["stop", "stopped", "loss", "-1r", "-0."]):
+    if LOSS_RE.search(r):
         return "loss"
-    if any(x in r for x in ["tp", "hit", "win", "+", "profit"]):
+    if WIN_RE.search(r):
         return "win"
-    if r.strip() == "":
-        return "pending"
     return "pending"
 
+BUCKET_EMOJI = {"win": "🟢", "loss": "🔴", "skipped": "⚪", "pending": "🟡"}
+
 def emoji_for_bucket(bucket: str) -> str:
-    return {"win":"🟢", "loss":"🔴", "skipped":"⚪", "pending":"🟡"}.get(bucket, "🟡")
+    return BUCKET_EMOJI.get(bucket, "🟡")
 
 def sparkline(values: list[float | None]) -> tuple[str, float | None, float | None]:
     vs = [v for v in values if isinstance(v, (int, float))]
@@ -69,14 +76,11 @@ def sparkline(values: list[float | None]) -> tuple[str, float | None, float | No
     mn, mx = min(vs), max(vs)
     if mx == mn:
         return (BLOCKS[0] * len(values), mn, mx)
-    out = []
-    for v in values:
-        if not isinstance(v, (int, float)):
-            out.append(" ")
-            continue
-        idx = int((v - mn) / (mx - mn) * (len(BLOCKS) - 1))
-        out.append(BLOCKS[max(0, min(len(BLOCKS)-1, idx))])
-    return ("".join(out), mn, mx)
+    span = mx - mn
+    top = len(BLOCKS) - 1
+    # mn <= v <= mx, so (v - mn) / span is within [0, 1] and the index within [0, top].
+    s = "".join(BLOCKS[int((v - mn) / span * top)] if isinstance(v, (int, float)) else " " for v in values)
+    return (s, mn, mx)
 
 def fmt(x) -> str:
     if x is None:
@@ -85,63 +89,66 @@ def fmt(x) -> str:
         return f"{x:.6f}".rstrip("0").rstrip(".")
     return str(x)
 
+def extract_row(path: str, data: dict) -> dict:
+    date = path[-15:-5]  # .../YYYY-MM-DD.json
+    okx = data.get("derivatives_okx", {}) or {}
+    t = data.get("paper_test_trade", {}) or {}
+    long = (t.get("long") or {})
+    short = (t.get("short") or {})
+
+    # result / R can be stored in different keys depending on scorer version
+    result = pick_str(data, RESULT_KEYS)
+    if not result:
+        review = data.get("paper_test_trade_review") or data.get("auto_score") or {}
+        if isinstance(review, dict):
+            result = pick_str(review, REVIEW_RESULT_KEYS)
+    if not result:
+        result = "pending"
+
+    R = pick_num(data, R_KEYS)
+    if R is None:
+        review = data.get("paper_test_trade_review") or data.get("auto_score") or {}
+        if isinstance(review, dict):
+            R = pick_num(review, REVIEW_R_KEYS)
+
+    return {
+        "date": date,
+        "run_timestamp_et": data.get("run_timestamp_et", ""),
+        "btc_spot_usd": pick_num(data, SPOT_KEYS) or data.get("btc_spot_usd", None),
+        "funding": okx.get("fundingRate", None),
+        "test_trade_id": t.get("test_trade_id", ""),
+        "long_entry": long.get("entry", None),
+        "long_stop": long.get("stop", None),
+        "long_tps": long.get("tps", []),
+        "short_entry": short.get("entry", None),
+        "short_stop": short.get("stop", None),
+        "short_tps": short.get("tps", []),
+        "result": result,
+        "bucket": classify_result(result),
+        "R": R,
+        "rel_json": rel_path(path),
+    }
+
 def extract_rows() -> list[dict]:
-    files = sorted(glob(os.path.join(JOURNAL_DIR, "*", "*.json")))
-    rows: list[dict] = []
-
-    for path in files:
-        data = read_json(path)
-        if not isinstance(data, dict):
-            continue
-
-        date = os.path.basename(path).replace(".json", "")
-        okx = data.get("derivatives_okx", {}) or {}
-        t = data.get("paper_test_trade", {}) or {}
-        long = (t.get("long") or {})
-        short = (t.get("short") or {})
-
-        # result / R can be stored in different keys depending on scorer version
-        result = pick_str(data, ["daily_result", "result", "outcome", "paper_test_trade_result", "status"])
-        if not result:
-            review = data.get("paper_test_trade_review") or data.get("auto_score") or {}
-            if isinstance(review, dict):
-                result = pick_str(review, ["result", "outcome", "status"])
-        if not result:
-            result = "pending"
-
-        R = pick_num(data, ["daily_R", "R", "paper_test_trade_R", "realized_R"])
-        if R is None:
-            review = data.get("paper_test_trade_review") or data.get("auto_score") or {}
-            if isinstance(review, dict):
-                R = pick_num(review, ["R", "realized_R", "score_R"])
-
-        rows.append({
-            "date": date,
-            "run_timestamp_et": data.get("run_timestamp_et", ""),
-            "btc_spot_usd": pick_num(data, ["btc_spot_usd"]) or data.get("btc_spot_usd", None),
-            "funding": okx.get("fundingRate", None),
-            "test_trade_id": t.get("test_trade_id", ""),
-            "long_entry": long.get("entry", None),
-            "long_stop": long.get("stop", None),
-            "long_tps": long.get("tps", []),
-            "short_entry": short.get("entry", None),
-            "short_stop": short.get("stop", None),
-            "short_tps": short.get("tps", []),
-            "result": result,
-            "bucket": classify_result(result),
-            "R": R,
-            "rel_json": os.path.relpath(path, ROOT).replace("\\", "/"),
-        })
-
-    rows.sort(key=lambda r: r["date"])
-    return rows
-
-def build_md(rows: list[dict]) -> str:
+    # already in date order (see day_file_entries)
+    return cached_rows("dashboard", extract_row)
+
+def build_md(rows: list[dict]) -> bytes:
     total = len(rows)
     latest = rows[-1] if rows else {}
-    last30 = rows[-30:] if total >= 30 else rows[:]
 
-    counts = Counter([r["bucket"] for r in rows])
+    # One pass: bucket counts over every row, sparkline values over the last 30.
+    counts = Counter()
+    spot_vals: list[float | None] = []
+    fund_vals: list[float | None] = []
+    tail_start = total - 30
+    for i, r in enumerate(rows):
+        counts[r["bucket"]] += 1
+        if i >= tail_start:
+            v = r.get("btc_spot_usd")
+            spot_vals.append(v if isinstance(v, (int, float)) else None)
+            v = r.get("funding")
+            fund_vals.append(v if isinstance(v, (int, float)) else None)
     wins = counts.get("win", 0)
     losses = counts.get("loss", 0)
     skipped = counts.get("skipped", 0)
@@ -149,105 +156,108 @@ def build_md(rows: list[dict]) -> str:
 
     winrate = (wins / max(1, (wins + losses))) * 100.0
 
-    spot_vals = [r.get("btc_spot_usd") if isinstance(r.get("btc_spot_usd"), (int, float)) else None for r in last30]
-    fund_vals = [r.get("funding") if isinstance(r.get("funding"), (int, float)) else None for r in last30]
     spot_s, spot_min, spot_max = sparkline(spot_vals)
     fund_s, fund_min, fund_max = sparkline(fund_vals)
 
-    L = []
-    L.append("# BTC Futures Journal — Dashboard")
-    L.append("")
-    L.append("> **Goal:** open this page and instantly see what’s being tested each day + results over time.")
-    L.append("")
-    L.append("## Quick links")
-    L.append("- **Latest summary:** `journal/LATEST.md`")
-    L.append("- **Full index:** `journal/INDEX.md`")
-    L.append("- **Optional notes/outcomes:** comment in the “BTC Journal Inbox” issue (optional)")
-    L.append("")
+    L: list[str] = []
+    w = L.append
+
+    w("# BTC Futures Journal — Dashboard\n")
+    w("\n")
+    w("> **Goal:** open this page and instantly see what’s being tested each day + results over time.\n")
+    w("\n")
+    w("## Quick links\n")
+    w("- **Latest summary:** `journal/LATEST.md`\n")
+    w("- **Full index:** `journal/INDEX.md`\n")
+    w("- **Optional notes/outcomes:** comment in the “BTC Journal Inbox” issue (optional)\n")
+    w("\n")
 
     # KPIs
-    L.append("## Snapshot")
-    L.append("")
-    L.append("| Metric | Value |")
-    L.append("|---|---:|")
-    L.append(f"| Total days | {total} |")
-    L.append(f"| Wins / Losses | {wins} / {losses} |")
-    L.append(f"| Win rate (wins / (wins+losses)) | {winrate:.1f}% |")
-    L.append(f"| Skipped | {skipped} |")
-    L.append(f"| Pending | {pending} |")
-    L.append(f"| Latest date | {latest.get('date','—')} |")
-    L.append(f"| Latest BTC spot | {fmt(latest.get('btc_spot_usd'))} |")
-    L.append(f"| Latest OKX funding | {fmt(latest.get('funding'))} |")
-    L.append("")
+    w("## Snapshot\n")
+    w("\n")
+    w("| Metric | Value |\n")
+    w("|---|---:|\n")
+    w(f"| Total days | {total} |\n")
+    w(f"| Wins / Losses | {wins} / {losses} |\n")
+    w(f"| Win rate (wins / (wins+losses)) | {winrate:.1f}% |\n")
+    w(f"| Skipped | {skipped} |\n")
+    w(f"| Pending | {pending} |\n")
+    w(f"| Latest date | {latest.get('date','—')} |\n")
+    w(f"| Latest BTC spot | {fmt(latest.get('btc_spot_usd'))} |\n")
+    w(f"| Latest OKX funding | {fmt(latest.get('funding'))} |\n")
+    w("\n")
 
     # Mermaid pie (GitHub renders Mermaid)
-    L.append("## Results breakdown")
-    L.append("")
-    L.append("```mermaid")
-    L.append("pie showData")
-    L.append(f'  "wins" : {wins}')
-    L.append(f'  "losses" : {losses}')
-    L.append(f'  "skipped" : {skipped}')
-    L.append(f'  "pending" : {pending}')
-    L.append("```")
-    L.append("")
+    w("## Results breakdown\n")
+    w("\n")
+    w("```mermaid\n")
+    w("pie showData\n")
+    w(f'  "wins" : {wins}\n')
+    w(f'  "losses" : {losses}\n')
+    w(f'  "skipped" : {skipped}\n')
+    w(f'  "pending" : {pending}\n')
+    w("```\n")
+    w("\n")
 
     # Trends (sparklines always render)
-    L.append("## Last 30 days trend (sparkline)")
-    L.append("")
-    L.append("| Metric | Trend | Min → Max |")
-    L.append("|---|---|---:|")
-    L.append(f"| BTC spot | `{spot_s}` | {fmt(spot_min)} → {fmt(spot_max)} |")
-    L.append(f"| OKX funding | `{fund_s}` | {fmt(fund_min)} → {fmt(fund_max)} |")
-    L.append("")
+    w("## Last 30 days trend (sparkline)\n")
+    w("\n")
+    w("| Metric | Trend | Min → Max |\n")
+    w("|---|---|---:|\n")
+    w(f"| BTC spot | `{spot_s}` | {fmt(spot_min)} → {fmt(spot_max)} |\n")
+    w(f"| OKX funding | `{fund_s}` | {fmt(fund_min)} → {fmt(fund_max)} |\n")
+    w("\n")
 
     # Latest test details
-    L.append("## Latest test (exact levels)")
-    L.append("")
+    w("## Latest test (exact levels)\n")
+    w("\n")
     if latest:
-        L.append(f"- **Test trade id:** `{latest.get('test_trade_id','')}`")
-        L.append(f"- **Result:** {emoji_for_bucket(latest.get('bucket','pending'))} `{latest.get('result','pending')}`")
+        w(f"- **Test trade id:** `{latest.get('test_trade_id','')}`\n")
+        w(f"- **Result:** {emoji_for_bucket(latest.get('bucket','pending'))} `{latest.get('result','pending')}`\n")
         if latest.get("R") is not None:
-            L.append(f"- **R:** `{latest.get('R')}`")
-        L.append("")
-        L.append("| Side | Entry | Stop | Take profits |")
-        L.append("|---|---:|---:|---|")
-        L.append(f"| Long | {fmt(latest.get('long_entry'))} | {fmt(latest.get('long_stop'))} | {latest.get('long_tps', [])} |")
-        L.append(f"| Short | {fmt(latest.get('short_entry'))} | {fmt(latest.get('short_stop'))} | {latest.get('short_tps', [])} |")
-        L.append("")
-        L.append(f"- JSON: `{latest.get('rel_json','')}`")
+            w(f"- **R:** `{latest.get('R')}`\n")
+        w("\n")
+        w("| Side | Entry | Stop | Take profits |\n")
+        w("|---|---:|---:|---|\n")
+        w(f"| Long | {fmt(latest.get('long_entry'))} | {fmt(latest.get('long_stop'))} | {latest.get('long_tps', [])} |\n")
+        w(f"| Short | {fmt(latest.get('short_entry'))} | {fmt(latest.get('short_stop'))} | {latest.get('short_tps', [])} |\n")
+        w("\n")
+        w(f"- JSON: `{latest.get('rel_json','')}`\n")
     else:
-        L.append("_No journal files found yet._")
-    L.append("")
+        w("_No journal files found yet._\n")
+    w("\n")
 
     # History table (recent first)
-    L.append("## Recent history (newest first)")
-    L.append("")
-    L.append("| Date | Result | R | Spot | Funding | JSON |")
-    L.append("|---|---|---:|---:|---:|---|")
-    for r in list(reversed(rows))[:30]:
-        e = emoji_for_bucket(r["bucket"])
-        json_link = r["rel_json"].replace("journal/", "")  # relative from /journal/DASHBOARD.md
-        L.append(
-            f"| {r['date']} | {e} `{r['result']}` | {fmt(r.get('R'))} | {fmt(r.get('btc_spot_usd'))} | {fmt(r.get('funding'))} | [{os.path.basename(r['rel_json'])}]({json_link}) |"
-        )
-
-    L.append("")
-    L.append("---")
-    L.append("### Notes")
-    L.append("- This page is generated automatically by `scripts/build_dashboard.py` from `journal/YYYY/YYYY-MM-DD.json`.")
-    L.append("- Optional manual notes/outcomes (from phone/desktop): comment in the Inbox issue; they’re stored under `journal_updates`.")
-    L.append("")
-    return "\n".join(L)
+    w("## Recent history (newest first)\n")
+    w("\n")
+    w("| Date | Result | R | Spot | Funding | JSON |\n")
+    w("|---|---|---:|---:|---:|---|\n")
+    row = "| {} | {} `{}` | {} | {} | {} | [{}]({}) |\n".format
+    for r in rows[:-31:-1]:
+        rel = r["rel_json"]
+        w(row(
+            r["date"], emoji_for_bucket(r["bucket"]), r["result"],
+            fmt(r.get("R")), fmt(r.get("btc_spot_usd")), fmt(r.get("funding")),
+            rel[-15:],  # file name
+            rel.replace("journal/", ""),  # relative from /journal/DASHBOARD.md
+        ))
+
+    w("\n")
+    w("---\n")
+    w("### Notes\n")
+    w("- This page is generated automatically by `scripts/build_dashboard.py` from `journal/YYYY/YYYY-MM-DD.json`.\n")
+    w("- Optional manual notes/outcomes (from phone/desktop): comment in the Inbox issue; they’re stored under `journal_updates`.\n")
+    w("\n")
+    return "".join(L).encode("utf-8")
 
 def main() -> None:
     os.makedirs(JOURNAL_DIR, exist_ok=True)
     rows = extract_rows()
     md = build_md(rows)
-    with open(OUT_MD, "w", encoding="utf-8") as f:
-        f.write(md)
-        f.write("\n")
-    print(f"Wrote {os.path.relpath(OUT_MD, ROOT)}")
+    if write_if_changed(OUT_MD, md):
+        print(f"Wrote {os.path.relpath(OUT_MD, ROOT)}")
+    else:
+        print(f"Unchanged {os.path.relpath(OUT_MD, ROOT)}")
 
 if __name__ == "__main__":
     main()
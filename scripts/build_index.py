@@ -2,18 +2,8 @@
 
 import json
 import os
-from glob import glob
 
-ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # repo root
-JOURNAL_DIR = os.path.join(ROOT, "journal")
-
-def read_json(path: str) -> dict | None:
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            x = json.load(f)
-        return x if isinstance(x, dict) else None
-    except Exception:
-        return None
+from _journal_cache import JOURNAL_DIR, cached_rows, read_json, rel_path, write_if_changed
 
 def fmt_float(x, nd=6) -> str:
     try:
@@ -31,32 +21,30 @@ def link_from_rel(relpath: str) -> str:
     rel = relpath.replace("\\", "/")
     return rel.split("journal/", 1)[-1] if "journal/" in rel else rel
 
-def build_index(rows: list[dict]) -> str:
-    lines = []
-    lines.append("# BTC Futures Journal Index")
-    lines.append("")
-    lines.append("Auto-generated after each run.")
-    lines.append("")
-    lines.append("- **Latest:** [LATEST.md](LATEST.md) | [LATEST.json](LATEST.json)")
-    lines.append("")
-    lines.append("| Date | BTC Spot (USD) | OKX Funding | Result | R | File |")
-    lines.append("|---|---:|---:|---|---:|---|")
-
-    for r in rows:
-        date = r.get("date", "")
-        spot = r.get("btc_spot_usd", "")
-        funding = r.get("fundingRate", "")
-
-        result = r.get("result", "")
-        rmult = r.get("r_multiple", "")
-
-        link = link_from_rel(r.get("relpath", ""))
-        lines.append(
-            f"| {date} | {spot} | {funding} | {result} | {rmult} | [{os.path.basename(link)}]({link}) |"
-        )
-
-    lines.append("")
-    return "\n".join(lines)
+INDEX_ROW = "| {} | {} | {} | {} | {} | [{}]({}) |\n".format
+
+def index_row(r: dict) -> str:
+    link = link_from_rel(r.get("relpath", ""))
+    return INDEX_ROW(
+        r.get("date", ""), r.get("btc_spot_usd", ""), r.get("fundingRate", ""),
+        r.get("result", ""), r.get("r_multiple", ""),
+        link.rpartition("/")[2], link,
+    )
+
+def build_index(rows: list[dict]) -> bytes:
+    lines = [
+        "# BTC Futures Journal Index\n",
+        "\n",
+        "Auto-generated after each run.\n",
+        "\n",
+        "- **Latest:** [LATEST.md](LATEST.md) | [LATEST.json](LATEST.json)\n",
+        "\n",
+        "| Date | BTC Spot (USD) | OKX Funding | Result | R | File |\n",
+        "|---|---:|---:|---|---:|---|\n",
+    ]
+    lines.extend(map(index_row, rows))
+    lines.append("\n")
+    return "".join(lines).encode("utf-8")
 
 def build_latest_md(latest: dict, rel_json_path: str) -> str:
     okx = (latest or {}).get("derivatives_okx", {}) or {}
@@ -75,7 +63,7 @@ def build_latest_md(latest: dict, rel_json_path: str) -> str:
     lines.append(f"- **OKX fundingRate:** {funding}")
     lines.append(f"- **OKX premium:** {premium}")
     lines.append("")
-    lines.append(f"Source JSON: [{os.path.basename(rel_link)}]({rel_link})")
+    lines.append(f"Source JSON: [{rel_link.rpartition('/')[2]}]({rel_link})")
     lines.append("")
     lines.append("History dashboard: [INDEX.md](INDEX.md)")
     lines.append("")
@@ -100,53 +88,53 @@ def summarize_result(d: dict) -> tuple[str, str]:
     r = pr.get("r_multiple")
     return (res, fmt_r(r))
 
-def main() -> None:
-    files = sorted(glob(os.path.join(JOURNAL_DIR, "*", "*.json")))
-    rows = []
+def extract_row(path: str, data: dict) -> dict:
+    date = path[-15:-5]  # .../YYYY-MM-DD.json
 
-    for path in files:
-        data = read_json(path)
-        if not isinstance(data, dict):
-            continue
+    okx = data.get("derivatives_okx", {}) or {}
+    result, rmult = summarize_result(data)
 
-        base = os.path.basename(path)
-        date = base.replace(".json", "")
+    return {
+        "date": date,
+        "btc_spot_usd": data.get("btc_spot_usd", ""),
+        "fundingRate": fmt_float(okx.get("fundingRate")),
+        "result": result,
+        "r_multiple": rmult,
+        "path": path,
+        "relpath": rel_path(path),
+    }
 
-        okx = data.get("derivatives_okx", {}) or {}
-        result, rmult = summarize_result(data)
+def main() -> None:
+    # Misses are parsed oldest first: if the newest day changed, LATEST.* reuse its dict.
+    last_parsed: dict = {}
 
-        rows.append({
-            "date": date,
-            "btc_spot_usd": data.get("btc_spot_usd", ""),
-            "fundingRate": fmt_float(okx.get("fundingRate")),
-            "result": result,
-            "r_multiple": rmult,
-            "path": path,
-            "relpath": os.path.relpath(path, ROOT),
-        })
+    def extract(path: str, data: dict) -> dict:
+        last_parsed["path"], last_parsed["data"] = path, data
+        return extract_row(path, data)
 
-    rows.sort(key=lambda r: r["date"], reverse=True)
+    rows = cached_rows("index", extract)
+    rows.reverse()  # newest first; day_file_entries() is oldest first
 
     # INDEX.md
     index_path = os.path.join(JOURNAL_DIR, "INDEX.md")
-    with open(index_path, "w", encoding="utf-8") as f:
-        f.write(build_index(rows[:180]))
-        f.write("\n")
+    write_if_changed(index_path, build_index(rows[:180]))
 
     # LATEST.md + LATEST.json
     if rows:
         newest = rows[0]
-        newest_data = read_json(newest["path"]) or {}
+        if last_parsed.get("path") == newest["path"]:
+            newest_data = last_parsed["data"]
+        else:
+            newest_data = read_json(newest["path"]) or {}
 
+        # LATEST.json is the machine-readable feed: replace it atomically.
         latest_json_path = os.path.join(JOURNAL_DIR, "LATEST.json")
-        with open(latest_json_path, "w", encoding="utf-8") as f:
-            json.dump(newest_data, f, indent=2, sort_keys=True)
-            f.write("\n")
+        # Day files already sort nested keys; sort the top level for hand-edited ones.
+        newest_data = dict(sorted(newest_data.items()))
+        write_if_changed(latest_json_path, json.dumps(newest_data, indent=2) + "\n")
 
         latest_md_path = os.path.join(JOURNAL_DIR, "LATEST.md")
-        with open(latest_md_path, "w", encoding="utf-8") as f:
-            f.write(build_latest_md(newest_data, newest["relpath"]))
-            f.write("\n")
+        write_if_changed(latest_md_path, build_latest_md(newest_data, newest["relpath"]) + "\n")
 
 if __name__ == "__main__":
     main()
@@ -2,12 +2,12 @@
 
 import json
 import os
+from collections import Counter
 from datetime import datetime
-from glob import glob
 
-def _load_json(p: str) -> dict:
-    with open(p, "r", encoding="utf-8") as f:
-        return json.load(f)
+from _journal_cache import JOURNAL_DIR, cached_rows, day_file_entries, read_json, write_if_changed
+
+LAST_DAYS_ROW = "| {date} | {triggered} | {filled} | {exit} | {R} |\n"
 
 def _safe_float(x, default=0.0) -> float:
     try:
@@ -15,17 +15,6 @@ def _safe_float(x, default=0.0) -> float:
     except Exception:
         return default
 
-def _list_day_files() -> list[str]:
-    files = glob(os.path.join("journal", "*", "*.json"))
-    files = [p for p in files if os.path.basename(p) not in {"LATEST.json", "METRICS.json"}]
-    out = []
-    for p in files:
-        name = os.path.basename(p)
-        if len(name) == 15 and name[4] == "-" and name[7] == "-" and name.endswith(".json"):
-            out.append(p)
-    out.sort()
-    return out
-
 def _review_or_pending(o: dict, date_fallback: str) -> dict:
     r = o.get("paper_test_trade_review")
     if isinstance(r, dict) and r:
@@ -49,57 +38,64 @@ def _review_or_pending(o: dict, date_fallback: str) -> dict:
         "R": 0.0,
     }
 
+def _extract_row(p: str, o: dict) -> dict:
+    date_fb = p[-15:-5]  # .../YYYY-MM-DD.json
+    r = _review_or_pending(o, date_fb)
+    return {
+        "date": r.get("date_et", date_fb),
+        "triggered": r.get("triggered", "pending"),
+        "filled": bool(r.get("filled", False)),
+        "exit": r.get("exit", "pending"),
+        "R": _safe_float(r.get("R"), 0.0),
+    }
+
 def build(days: int = 30) -> tuple[dict, str]:
-    files = _list_day_files()
+    files = day_file_entries()
     if not files:
         stats = {"status": "no_files"}
         return stats, "# Metrics\n\nNo journal day files found.\n"
 
-    tail = files[-days:]
-    rows = []
-    for p in tail:
-        o = _load_json(p)
-        date_fb = os.path.splitext(os.path.basename(p))[0]
-        r = _review_or_pending(o, date_fb)
-        rows.append({
-            "date": r.get("date_et", date_fb),
-            "triggered": r.get("triggered", "pending"),
-            "filled": bool(r.get("filled", False)),
-            "exit": r.get("exit", "pending"),
-            "R": _safe_float(r.get("R"), 0.0),
-        })
-
-    total_R = sum(x["R"] for x in rows)
+    rows = cached_rows("metrics", _extract_row, files[-days:])
+
+    # Every aggregate in one pass over the window.
+    total_R = trade_R = 0.0
+    trade_n = no_trade_n = pending_n = wins_n = losses_n = 0
+    exit_ct: Counter[str] = Counter()
+    side_ct: Counter[str] = Counter()
+    for x in rows:
+        R = x["R"]
+        ex = x["exit"]
+        total_R += R
+        exit_ct[str(ex)] += 1
+        side_ct[str(x["triggered"])] += 1
+        if x["filled"]:
+            trade_n += 1
+            trade_R += R
+            if R > 0:
+                wins_n += 1
+            elif R < 0:
+                losses_n += 1
+        if ex == "no_trigger":
+            no_trade_n += 1
+        elif ex == "pending":
+            pending_n += 1
     avg_R_day = total_R / max(1, len(rows))
 
-    trade_rows = [x for x in rows if x["filled"] is True]
-    no_trade_rows = [x for x in rows if x["exit"] == "no_trigger"]
-    pending_rows = [x for x in rows if x["exit"] == "pending"]
-
-    wins = [x for x in trade_rows if x["R"] > 0]
-    losses = [x for x in trade_rows if x["R"] < 0]
-
-    def grp(key: str) -> dict[str, int]:
-        d: dict[str, int] = {}
-        for x in rows:
-            k = str(x.get(key, "pending"))
-            d[k] = d.get(k, 0) + 1
-        return dict(sorted(d.items(), key=lambda kv: (-kv[1], kv[0])))
-
+    # Keys and breakdowns in sorted order: METRICS.json is dumped without sort_keys.
     stats = {
-        "window_days": len(rows),
-        "total_R": round(total_R, 3),
-        "avg_R_per_day": round(avg_R_day, 3),
-        "trade_days": len(trade_rows),
-        "no_trade_days": len(no_trade_rows),
-        "pending_days": len(pending_rows),
-        "win_trades": len(wins),
-        "loss_trades": len(losses),
-        "win_rate_on_trades": round((len(wins) / max(1, len(trade_rows))) * 100, 1),
-        "expectancy_R_per_trade": round((sum(x["R"] for x in trade_rows) / max(1, len(trade_rows))), 3),
-        "exit_breakdown": grp("exit"),
-        "side_breakdown": grp("triggered"),
         "asof_utc": datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "avg_R_per_day": round(avg_R_day, 3),
+        "exit_breakdown": dict(sorted(exit_ct.items())),
+        "expectancy_R_per_trade": round((trade_R / max(1, trade_n)), 3),
+        "loss_trades": losses_n,
+        "no_trade_days": no_trade_n,
+        "pending_days": pending_n,
+        "side_breakdown": dict(sorted(side_ct.items())),
+        "total_R": round(total_R, 3),
+        "trade_days": trade_n,
+        "win_rate_on_trades": round((wins_n / max(1, trade_n)) * 100, 1),
+        "win_trades": wins_n,
+        "window_days": len(rows),
     }
 
     lines = []
@@ -112,7 +108,7 @@ def build(days: int = 30) -> tuple[dict, str]:
     def md_table(title: str, d: dict[str, int]):
         lines.append(f"\n## {title}\n")
         lines.append("| Item | Count |\n|---|---:|\n")
-        for k, v in d.items():
+        for k, v in sorted(d.items(), key=lambda kv: (-kv[1], kv[0])):
             lines.append(f"| {k} | {v} |\n")
 
     md_table("Exit breakdown", stats["exit_breakdown"])
@@ -120,21 +116,23 @@ def build(days: int = 30) -> tuple[dict, str]:
 
     lines.append("\n## Last days\n")
     lines.append("| Date | Side | Filled | Exit | R |\n|---|---|---|---|---:|\n")
-    for x in rows[-14:]:
-        lines.append(f"| {x['date']} | {x['triggered']} | {x['filled']} | {x['exit']} | {x['R']} |\n")
+    lines.append("".join(map(LAST_DAYS_ROW.format_map, rows[-14:])))
 
     return stats, "".join(lines)
 
 def main():
     days = int((os.getenv("METRICS_DAYS") or "30").strip())
     stats, md = build(days=days)
-    os.makedirs("journal", exist_ok=True)
-    with open("journal/METRICS.json", "w", encoding="utf-8") as f:
-        json.dump(stats, f, indent=2, sort_keys=True)
-        f.write("\n")
-    with open("journal/METRICS.md", "w", encoding="utf-8") as f:
-        f.write(md)
-    print("Wrote journal/METRICS.md and journal/METRICS.json")
+    os.makedirs(JOURNAL_DIR, exist_ok=True)
+    json_path = os.path.join(JOURNAL_DIR, "METRICS.json")
+    # asof_utc is when the stats last changed: keep it if nothing else did.
+    prev = read_json(json_path)
+    if prev and "asof_utc" in prev and "asof_utc" in stats and {**stats, "asof_utc": prev["asof_utc"]} == prev:
+        stats["asof_utc"] = prev["asof_utc"]
+    json_changed = write_if_changed(json_path, json.dumps(stats, indent=2) + "\n")
+    md_changed = write_if_changed(os.path.join(JOURNAL_DIR, "METRICS.md"), md)
+    state = "Wrote" if json_changed or md_changed else "Unchanged"
+    print(f"{state} journal/METRICS.md and journal/METRICS.json")
 
 if __name__ == "__main__":
     main()
@@ -1,74 +1,141 @@
 ﻿from __future__ import annotations
 
-import json, os, re
-from datetime import datetime, timedelta, timezone
-from zoneinfo import ZoneInfo
-import requests
-
-ET = ZoneInfo("America/New_York")
-
-def _ms(dt: datetime) -> int:
-    return int(dt.timestamp() * 1000)
-
-def http_get_json(url: str, params: dict | None = None, timeout: int = 25):
-    r = requests.get(url, params=params, timeout=timeout, headers={"User-Agent": "btc-journal-bot/1.0"})
-    r.raise_for_status()
-    return r.json()
-
-def fetch_15m_binance(date_et: str) -> list[dict]:
+import argparse, bisect, json, os, re, sys
+from datetime import date, datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # repo root
+sys.path.insert(0, ROOT)
+
+from journal_common import (
+    BAR_15M_MS,
+    BINANCE_KLINES_URL,
+    ET,
+    Klines,
+    env_flag,
+    epoch_ms,
+    http_get_json,
+    journal_json_bytes,
+    to_klines,
+    write_atomic,
+)
+
+KLINES_PAGE_LIMIT = 1000
+
+# Set to rescore days whose review is already final (see _already_scored).
+FORCE_RESCORE_ENV = "FORCE_RESCORE"
+
+# "15m close >= 93481.5" -> (">=", "93481.5")
+TRIGGER_RE = re.compile(r"(>=|<=)\s*([0-9]+(?:\.[0-9]+)?)")
+
+def _window_ms(date_et: str) -> tuple[int, int]:
+    """Scoring window for a journal day: 06:00 ET to 06:00 ET next day, in epoch ms."""
     y, m, d = [int(x) for x in date_et.split("-")]
     start_et = datetime(y, m, d, 6, 0, tzinfo=ET)
     end_et = start_et + timedelta(days=1)
+    return epoch_ms(start_et), epoch_ms(end_et)
+
+def fetch_15m_binance_range(start_ms: int, end_ms: int) -> list[list]:
+    """Raw 15m kline rows opening in [start_ms, end_ms], paged 1000 bars (~10 days) at a time."""
+    rows: list[list] = []
+    cur = start_ms
+    while cur <= end_ms:
+        page = http_get_json(BINANCE_KLINES_URL, params={
+            "symbol": "BTCUSDT",
+            "interval": "15m",
+            "startTime": cur,
+            "endTime": end_ms,
+            "limit": KLINES_PAGE_LIMIT,
+        })
+        if not page:
+            break
+        rows.extend(page)
+        if len(page) < KLINES_PAGE_LIMIT:
+            break
+        cur = int(page[-1][0]) + BAR_15M_MS
+    return rows
 
-    url = "https://data-api.binance.vision/api/v3/klines"
+def split_15m_by_day(rows: list[list], dates_et: list[str]) -> dict[str, Klines]:
+    """Slice raw kline rows (in open-time order) from one wide fetch into each day's scoring window."""
+    t = [int(r[0]) for r in rows]
+    out: dict[str, Klines] = {}
+    for d in dates_et:
+        start_ms, end_ms = _window_ms(d)
+        out[d] = to_klines(rows[bisect.bisect_left(t, start_ms):bisect.bisect_right(t, end_ms)])
+    return out
+
+def fetch_15m_binance(date_et: str) -> Klines:
+    start_ms, end_ms = _window_ms(date_et)
     params = {
         "symbol": "BTCUSDT",
         "interval": "15m",
-        "startTime": _ms(start_et.astimezone(timezone.utc)),
-        "endTime": _ms(end_et.astimezone(timezone.utc)),
-        "limit": 1000,
+        "startTime": start_ms,
+        "endTime": end_ms,
+        "limit": KLINES_PAGE_LIMIT,
     }
-    data = http_get_json(url, params=params)
-    rows = []
-    for k in data:
-        rows.append({
-            "t_open_ms": int(k[0]),
-            "open": float(k[1]),
-            "high": float(k[2]),
-            "low": float(k[3]),
-            "close": float(k[4]),
-        })
-    return rows
+    return to_klines(http_get_json(BINANCE_KLINES_URL, params=params))
 
 def parse_trigger(s: str) -> tuple[str, float] | None:
-    m = re.search(r"(>=|<=)\s*([0-9]+(?:\.[0-9]+)?)", s or "")
+    m = TRIGGER_RE.search(s or "")
     if not m:
         return None
     return m.group(1), float(m.group(2))
 
 def load_json(path: str) -> dict:
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+    with open(path, "rb") as f:
+        return json.loads(f.read())
 
 def save_json(path: str, obj: dict) -> None:
     os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(obj, f, indent=2, sort_keys=True)
-        f.write("\n")
+    # Same serializer as the playbook writer, so both produce identical bytes.
+    write_atomic(path, journal_json_bytes(obj))
 
 def journal_path(date_et: str) -> str:
-    y = date_et.split("-")[0]
-    return os.path.join("journal", y, f"{date_et}.json")
-
-def _dt_open_et(candle: dict) -> datetime:
-    return datetime.fromtimestamp(candle["t_open_ms"] / 1000, tz=timezone.utc).astimezone(ET)
-
-def score(date_et: str) -> dict:
+    return f"journal/{date_et[:4]}/{date_et}.json"
+
+def _dt_open_et(t_open_ms: int) -> datetime:
+    # Bar opens are whole seconds, so integer division is exact.
+    return datetime.fromtimestamp(t_open_ms // 1000, tz=ET)
+
+def _already_scored(j: dict, date_et: str) -> bool:
+    """True if the journal holds a review scored after the window's last bar closed.
+
+    The daily 06:0x ET run scores yesterday before that cutoff (06:15 ET), so
+    its reviews are never final and this only ever skips days in backfills
+    and manual reruns. FORCE_RESCORE (backfill's rescore input) redoes final
+    reviews too, e.g. after a change to the scoring rules.
+    """
+    if env_flag(FORCE_RESCORE_ENV):
+        return False
+    review = j.get("paper_test_trade_review")
+    if not isinstance(review, dict) or review.get("status") != "scored":
+        return False
+    final_at = _dt_open_et(_window_ms(date_et)[1] + BAR_15M_MS).strftime("%Y-%m-%d %H:%M:%S")
+    return str(review.get("scored_at_et") or "") >= final_at
+
+def _load_unscored(date_et: str) -> tuple[str, dict | None, dict | None]:
+    """(path, journal, None) for a day that needs scoring, else (path, None, result)."""
     path = journal_path(date_et)
     if not os.path.exists(path):
-        return {"status": "missing_file", "path": path}
+        return path, None, {"status": "missing_file", "path": path}
 
     j = load_json(path)
+    # Idempotent reruns: a final review costs one file read, no candle fetch.
+    if _already_scored(j, date_et):
+        return path, None, {"status": "already_scored", "path": path, "result": j.get("daily_result"), "R": j.get("daily_R")}
+    return path, j, None
+
+def score(date_et: str, candles: Klines | None = None) -> dict:
+    """Score date_et's paper test trade into its journal file.
+
+    candles, when given, is the day's 06:00-06:00 ET window already sliced
+    out of a wider fetch; otherwise it is fetched.
+    """
+    path, j, done = _load_unscored(date_et)
+    if done is not None:
+        return done
+    return _score_journal(date_et, path, j, candles)
+
+def _score_journal(date_et: str, path: str, j: dict, candles: Klines | None) -> dict:
     t = (j.get("paper_test_trade") or {})
     long = (t.get("long") or {})
     short = (t.get("short") or {})
@@ -97,8 +164,11 @@ def score(date_et: str) -> dict:
     long_tps = [float(x) for x in (long.get("tps") or [])]
     short_tps = [float(x) for x in (short.get("tps") or [])]
 
-    candles = fetch_15m_binance(date_et)
-    if not candles:
+    if candles is None:
+        candles = fetch_15m_binance(date_et)
+    t_open, highs, lows, closes = candles.t_open_ms, candles.high, candles.low, candles.close
+    n = len(closes)
+    if not n:
         j["daily_result"] = "no_candles"
         j["daily_R"] = 0.0
         j["paper_test_trade_review"] = {"status": "no_candles"}
@@ -106,18 +176,16 @@ def score(date_et: str) -> dict:
         return {"status": "no_candles", "path": path}
 
     # earliest trigger (by candle close rule)
+    long_lvl, short_lvl = lt[1], st[1]
     triggered = "none"
-    trig_idx = None
-    for i, c in enumerate(candles):
-        long_hit = c["close"] >= lt[1]
-        short_hit = c["close"] <= st[1]
-        if long_hit or short_hit:
-            trig_idx = i
-            if long_hit and short_hit:
-                triggered = "conflict"
-            else:
-                triggered = "long" if long_hit else "short"
-            break
+    trig_idx = next((i for i, cl in enumerate(closes) if cl >= long_lvl or cl <= short_lvl), None)
+    if trig_idx is not None:
+        long_hit = closes[trig_idx] >= long_lvl
+        short_hit = closes[trig_idx] <= short_lvl
+        if long_hit and short_hit:
+            triggered = "conflict"
+        else:
+            triggered = "long" if long_hit else "short"
 
     scored_at = datetime.now(tz=ET).strftime("%Y-%m-%d %H:%M:%S")
     review = {
@@ -145,21 +213,14 @@ def score(date_et: str) -> dict:
         return {"status": triggered, "path": path}
 
     # trigger time = candle close time (open + 15m)
-    trig_open = _dt_open_et(candles[trig_idx])
+    trig_open = _dt_open_et(t_open[trig_idx])
     review["trigger_time_et"] = (trig_open + timedelta(minutes=15)).strftime("%Y-%m-%d %H:%M")
 
     # require entry fill AFTER trigger (OCO conditional arms, then entry must trade)
-    fill_idx = None
-    for k in range(trig_idx + 1, len(candles)):
-        c = candles[k]
-        if triggered == "long":
-            if c["high"] >= long_entry:
-                fill_idx = k
-                break
-        else:
-            if c["low"] <= short_entry:
-                fill_idx = k
-                break
+    if triggered == "long":
+        fill_idx = next((k for k, hi in enumerate(highs[trig_idx + 1:], trig_idx + 1) if hi >= long_entry), None)
+    else:
+        fill_idx = next((k for k, lo in enumerate(lows[trig_idx + 1:], trig_idx + 1) if lo <= short_entry), None)
 
     if fill_idx is None:
         review["exit"] = "armed_not_filled"
@@ -170,7 +231,7 @@ def score(date_et: str) -> dict:
         return {"status": "armed_not_filled", "path": path}
 
     review["filled"] = True
-    review["fill_time_et"] = _dt_open_et(candles[fill_idx]).strftime("%Y-%m-%d %H:%M")
+    review["fill_time_et"] = _dt_open_et(t_open[fill_idx]).strftime("%Y-%m-%d %H:%M")
 
     # risk (avoid div by zero)
     risk_long = abs(long_entry - long_stop)
@@ -183,77 +244,51 @@ def score(date_et: str) -> dict:
         save_json(path, j)
         return {"status": "bad_risk_zero", "path": path}
 
-    max_fav_R = 0.0
-    max_adv_R = 0.0
+    # The exit bar is the first bar from the fill on that touches the stop or
+    # the nearest TP (the conservative "first TP only" rule).
+    if triggered == "long":
+        entry, stop, risk = long_entry, long_stop, risk_long
+        tp_first = min(long_tps) if long_tps else None
+        exit_idx = next((k for k, (hi, lo) in enumerate(zip(highs[fill_idx:], lows[fill_idx:]), fill_idx)
+                         if lo <= stop or (tp_first is not None and hi >= tp_first)), None)
+        end = n if exit_idx is None else exit_idx + 1
+        max_fav_R = max(0.0, (max(highs[fill_idx:end]) - entry) / risk)
+        max_adv_R = max(0.0, (entry - min(lows[fill_idx:end])) / risk)
+        if exit_idx is not None:
+            stop_hit = lows[exit_idx] <= stop
+            tp_hit = tp_first if tp_first is not None and highs[exit_idx] >= tp_first else None
+    else:  # short
+        entry, stop, risk = short_entry, short_stop, risk_short
+        tp_first = max(short_tps) if short_tps else None
+        exit_idx = next((k for k, (hi, lo) in enumerate(zip(highs[fill_idx:], lows[fill_idx:]), fill_idx)
+                         if hi >= stop or (tp_first is not None and lo <= tp_first)), None)
+        end = n if exit_idx is None else exit_idx + 1
+        max_fav_R = max(0.0, (entry - min(lows[fill_idx:end])) / risk)
+        max_adv_R = max(0.0, (max(highs[fill_idx:end]) - entry) / risk)
+        if exit_idx is not None:
+            stop_hit = highs[exit_idx] >= stop
+            tp_hit = tp_first if tp_first is not None and lows[exit_idx] <= tp_first else None
+
     exit_reason = None
     exit_price = None
     exit_time_et = None
-
-    # simulate from fill candle forward
-    for c in candles[fill_idx:]:
-        t_open = _dt_open_et(c)
-        hi, lo, cl = c["high"], c["low"], c["close"]
-
-        if triggered == "long":
-            max_fav_R = max(max_fav_R, (hi - long_entry) / risk_long)
-            max_adv_R = max(max_adv_R, (long_entry - lo) / risk_long)
-
-            stop_hit = lo <= long_stop
-            tp_hit = None
-            for tp in sorted(long_tps):
-                if hi >= tp:
-                    tp_hit = tp
-                    break  # first TP only (conservative)
-
-            if stop_hit and tp_hit is not None:
-                exit_reason = "ambiguous_stop_and_tp_same_candle"
-                exit_price = long_stop
-                exit_time_et = t_open.strftime("%Y-%m-%d %H:%M")
-                break
-            if stop_hit:
-                exit_reason = "stopped"
-                exit_price = long_stop
-                exit_time_et = t_open.strftime("%Y-%m-%d %H:%M")
-                break
-            if tp_hit is not None:
-                exit_reason = f"tp_hit_{tp_hit}"
-                exit_price = tp_hit
-                exit_time_et = t_open.strftime("%Y-%m-%d %H:%M")
-                break
-
-        else:  # short
-            max_fav_R = max(max_fav_R, (short_entry - lo) / risk_short)
-            max_adv_R = max(max_adv_R, (hi - short_entry) / risk_short)
-
-            stop_hit = hi >= short_stop
-            tp_hit = None
-            for tp in sorted(short_tps, reverse=True):
-                if lo <= tp:
-                    tp_hit = tp
-                    break  # first TP only (conservative)
-
-            if stop_hit and tp_hit is not None:
-                exit_reason = "ambiguous_stop_and_tp_same_candle"
-                exit_price = short_stop
-                exit_time_et = t_open.strftime("%Y-%m-%d %H:%M")
-                break
-            if stop_hit:
-                exit_reason = "stopped"
-                exit_price = short_stop
-                exit_time_et = t_open.strftime("%Y-%m-%d %H:%M")
-                break
-            if tp_hit is not None:
-                exit_reason = f"tp_hit_{tp_hit}"
-                exit_price = tp_hit
-                exit_time_et = t_open.strftime("%Y-%m-%d %H:%M")
-                break
+    if exit_idx is not None:
+        exit_time_et = _dt_open_et(t_open[exit_idx]).strftime("%Y-%m-%d %H:%M")
+        if stop_hit and tp_hit is not None:
+            exit_reason = "ambiguous_stop_and_tp_same_candle"
+            exit_price = stop
+        elif stop_hit:
+            exit_reason = "stopped"
+            exit_price = stop
+        else:
+            exit_reason = f"tp_hit_{tp_hit}"
+            exit_price = tp_hit
 
     # expiry-close if nothing hit
     if exit_price is None:
-        last = candles[-1]
-        last_open = _dt_open_et(last)
+        last_open = _dt_open_et(t_open[-1])
         exit_reason = "expired_close"
-        exit_price = float(last["close"])
+        exit_price = float(closes[-1])
         exit_time_et = (last_open + timedelta(minutes=15)).strftime("%Y-%m-%d %H:%M")
 
     # realized R
@@ -277,13 +312,60 @@ def score(date_et: str) -> dict:
     save_json(path, j)
     return {"status": "ok", "path": path, "result": j["daily_result"], "R": j["daily_R"]}
 
-def main():
-    date_et = (os.getenv("DATE_ET") or "").strip()
+def score_many(dates_et: list[str]) -> list[dict]:
+    """score() several days, oldest first (duplicates dropped). Missing and already
+    scored days are settled from their files; one paged fetch covers the rest."""
+    dates_et = sorted(set(dates_et))
+    loaded = {d: _load_unscored(d) for d in dates_et}
+    pending = [d for d in dates_et if loaded[d][2] is None]
+    by_day: dict[str, Klines] = {}
+    if pending:
+        rows = fetch_15m_binance_range(_window_ms(pending[0])[0], _window_ms(pending[-1])[1])
+        by_day = split_15m_by_day(rows, pending)
+
+    outs = []
+    for d in dates_et:
+        path, j, done = loaded[d]
+        outs.append(done if done is not None else _score_journal(d, path, j, by_day[d]))
+    return outs
+
+def main(date_et: str | None = None) -> dict | list[dict]:
+    if date_et is None:
+        # DATES_ET="2026-01-03,2026-01-04" scores a batch in one process.
+        dates = [d.strip() for d in (os.getenv("DATES_ET") or "").split(",") if d.strip()]
+        if dates:
+            outs = score_many(dates)
+            print(json.dumps(outs, indent=2))
+            return outs
+        date_et = (os.getenv("DATE_ET") or "").strip()
     if not date_et:
         date_et = (datetime.now(tz=ET) - timedelta(days=1)).strftime("%Y-%m-%d")
     out = score(date_et)
     print(json.dumps(out, indent=2))
+    return out
+
+def cli(argv: list[str] | None = None) -> None:
+    """Command line: one day (--date, else DATE_ET/DATES_ET/yesterday as main() does),
+    or --start/--end to score a whole range through score_many() in this process."""
+    p = argparse.ArgumentParser(description="Score journal paper test trades against Binance 15m candles.")
+    p.add_argument("--date", type=date.fromisoformat, help="day to score, YYYY-MM-DD")
+    p.add_argument("--start", type=date.fromisoformat, help="first day of a range, YYYY-MM-DD")
+    p.add_argument("--end", type=date.fromisoformat, help="last day of the range (default: --start)")
+    args = p.parse_args(argv)
+
+    if args.start is None:
+        if args.end is not None:
+            p.error("--end requires --start")
+        main(args.date.isoformat() if args.date else None)
+        return
+    if args.date is not None:
+        p.error("--date cannot be combined with --start/--end")
+    end = args.end or args.start
+    if end < args.start:
+        p.error("--end is before --start")
+    dates = [(args.start + timedelta(days=i)).isoformat() for i in range((end - args.start).days + 1)]
+    print(json.dumps(score_many(dates), indent=2))
 
 if __name__ == "__main__":
-    main()
+    cli()
 